@@ -31,6 +31,11 @@ class SharingApp:
         self.bluetooth_hid: BluetoothHID = None
         self.hid_reports: HIDReportGenerator = None
         
+        # Serializes building and sending mouse reports across the input
+        # dispatch thread (buttons) and the D-Bus main loop (motion flushes),
+        # so a report never reaches the host after a newer one
+        self._mouse_send_lock = threading.Lock()
+        
         self.is_sharing = False
         
         # Setup signal handlers
@@ -67,8 +72,8 @@ class SharingApp:
                 self.gui.set_sharing(False)
                 return
             
-            # Start D-Bus main loop
-            self.bluetooth_hid.start_mainloop()
+            # Start D-Bus main loop (also flushes merged mouse motion)
+            self.bluetooth_hid.start_mainloop(mouse_flush=self._flush_mouse)
             
             # Set adapter to discoverable
             if not self.bluetooth_hid.set_discoverable(True):
@@ -76,10 +81,11 @@ class SharingApp:
                 logger.warning("Could not set adapter discoverable")
             
             # Initialize input grabber with callbacks
+            on_keyboard, on_mouse_button, on_mouse_move = self._bind_input_callbacks()
             self.input_grabber = InputGrabber(
-                keyboard_callback=self._on_keyboard_event,
-                mouse_button_callback=self._on_mouse_button_event,
-                mouse_move_callback=self._on_mouse_move_event,
+                keyboard_callback=on_keyboard,
+                mouse_button_callback=on_mouse_button,
+                mouse_move_callback=on_mouse_move,
                 escape_callback=self._on_escape_combo
             )
             
@@ -136,41 +142,66 @@ class SharingApp:
             logger.error(f"Error stopping sharing: {e}", exc_info=True)
             self.gui.update_status(f"Error stopping: {str(e)}")
     
-    def _on_keyboard_event(self, key_code: int, value: int):
-        """Handle keyboard event"""
-        if not self.is_sharing or not self.hid_reports or not self.bluetooth_hid:
-            return
+    def _bind_input_callbacks(self):
+        """
+        Build the per-event input callbacks.
         
-        try:
-            report = self.hid_reports.process_keyboard_event(key_code, value)
-            if report:
-                self.bluetooth_hid.send_keyboard_report(report)
-        except Exception as e:
-            logger.error(f"Error processing keyboard event: {e}")
-    
-    def _on_mouse_button_event(self, button_code: int, value: int):
-        """Handle mouse button event"""
-        if not self.is_sharing or not self.hid_reports or not self.bluetooth_hid:
-            return
+        Each callback goes straight from report generation to the profile's
+        send_report, with the bound methods resolved once here rather than
+        through SharingApp -> BluetoothHID -> HIDProfile on every event. The
+        callbacks live only as long as the input grabber they are given to,
+        which is stopped before the Bluetooth side is torn down.
         
-        try:
-            report = self.hid_reports.process_mouse_event(button_code, value)
-            if report:
-                self.bluetooth_hid.send_mouse_report(report)
-        except Exception as e:
-            logger.error(f"Error processing mouse button event: {e}")
+        Returns:
+            Tuple of (keyboard, mouse_button, mouse_move) callbacks
+        """
+        process_keyboard_event = self.hid_reports.process_keyboard_event
+        process_mouse_event = self.hid_reports.process_mouse_event
+        process_mouse_movement = self.hid_reports.process_mouse_movement
+        send_report = self.bluetooth_hid.profile.send_report
+        request_mouse_flush = self.bluetooth_hid.request_mouse_flush
+        mouse_send_lock = self._mouse_send_lock
+        
+        def on_keyboard(key_code: int, value: int):
+            try:
+                send_report(process_keyboard_event(key_code, value))
+            except Exception as e:
+                logger.error(f"Error processing keyboard event: {e}")
+        
+        def on_mouse_button(button_code: int, value: int):
+            try:
+                with mouse_send_lock:
+                    send_report(process_mouse_event(button_code, value))
+            except Exception as e:
+                logger.error(f"Error processing mouse button event: {e}")
+        
+        def on_mouse_move(rel_x: int, rel_y: int, rel_wheel: int = 0):
+            try:
+                # Motion is merged and sent by _flush_mouse on the D-Bus main loop
+                process_mouse_movement(rel_x, rel_y, rel_wheel)
+                request_mouse_flush()
+            except Exception as e:
+                logger.error(f"Error processing mouse movement: {e}")
+        
+        return on_keyboard, on_mouse_button, on_mouse_move
     
-    def _on_mouse_move_event(self, rel_x: int, rel_y: int, rel_wheel: int = 0):
-        """Handle mouse movement event"""
-        if not self.is_sharing or not self.hid_reports or not self.bluetooth_hid:
-            return
+    def _flush_mouse(self) -> bool:
+        """Send accumulated mouse movement. Returns False when there was none."""
+        hid_reports = self.hid_reports
+        bluetooth_hid = self.bluetooth_hid
+        if not hid_reports or not bluetooth_hid:
+            return False
         
         try:
-            report = self.hid_reports.process_mouse_movement(rel_x, rel_y, rel_wheel)
-            if report:
-                self.bluetooth_hid.send_mouse_report(report)
+            with self._mouse_send_lock:
+                report = hid_reports.flush_mouse_report()
+                if report is None:
+                    return False
+                bluetooth_hid.send_mouse_report(report, motion=True)
+            return True
         except Exception as e:
-            logger.error(f"Error processing mouse movement: {e}")
+            logger.error(f"Error flushing mouse movement: {e}")
+            return False
     
     def _on_escape_combo(self):
         """Handle escape combination detection"""
@@ -5,13 +5,20 @@ import dbus.service
 import dbus.mainloop.glib
 import dbus.exceptions
 import logging
+import select
 import socket
 import struct
-from typing import Optional, Callable
+import threading
+from collections import deque
+from typing import Optional, Callable, Deque, Dict, List, Tuple, Union
 from gi.repository import GLib
+from src.constants import MOUSE_FLUSH_INTERVAL_MS
 
 logger = logging.getLogger(__name__)
 
+# Report payloads: bytes, or reusable buffers from HIDReportGenerator's pool
+ReportBuffer = Union[bytes, bytearray, memoryview]
+
 # Message shown when HID UUID is already taken (e.g. by BlueZ input plugin)
 UUID_ALREADY_REGISTERED_MSG = (
     "The HID Bluetooth profile is already in use (often by BlueZ's input plugin). "
@@ -25,6 +32,20 @@ BLUEZ_PROFILE_MANAGER = 'org.bluez.ProfileManager1'
 BLUEZ_ADAPTER = 'org.bluez.Adapter1'
 BLUEZ_DEVICE = 'org.bluez.Device1'
 BLUEZ_PROFILE = 'org.bluez.Profile1'
+DBUS_OBJECT_MANAGER = 'org.freedesktop.DBus.ObjectManager'
+DBUS_PROPERTIES = 'org.freedesktop.DBus.Properties'
+
+# L2CAP PSMs of the HID control and interrupt channels
+HID_PSM_CONTROL = 0x11
+HID_PSM_INTERRUPT = 0x13
+
+# Reports held per socket while the link is congested before the oldest
+# queued mouse motion report is dropped. Keyboard and button reports are
+# never dropped, so a backlog of those may grow past this.
+TX_BACKLOG_LEN = 64
+
+# Seconds the backlog writer waits for a congested socket before re-checking
+TX_WAIT_TIMEOUT = 1.0
 
 # HID Profile UUID
 HID_PROFILE_UUID = '00001124-0000-1000-8000-00805f9b34fb'
@@ -90,51 +111,98 @@ HID_SDP_RECORD = """
 </record>
 """
 
-
 class HIDProfile(dbus.service.Object):
     """BlueZ HID Profile implementation"""
     
-    def __init__(self, bus, path, report_callback: Optional[Callable[[bytes], None]] = None):
+    def __init__(self, bus, path):
         """
         Initialize HID Profile.
         
         Args:
             bus: D-Bus system bus
             path: Object path for this profile
-            report_callback: Called when HID reports need to be sent
         """
         dbus.service.Object.__init__(self, bus, path)
         self.bus = bus
-        self.report_callback = report_callback
-        self.connected_devices = {}  # device_path -> (control_fd, interrupt_fd)
+        self.connected_devices = {}  # device_path -> {psm: socket}
+        # (device_path, interrupt socket) pairs, rebuilt on connect/disconnect
+        # so sending a report is a plain list walk
+        self._sockets: List[Tuple[str, socket.socket]] = []
         self.mainloop = None
+        
+        # Reports a socket could not take immediately, as (data, droppable)
+        # pairs, drained in order by a writer thread that only runs while some
+        # backlog exists
+        self._tx_backlog: Dict[socket.socket, Deque[Tuple[ReportBuffer, bool]]] = {}
+        self._tx_lock = threading.Lock()
+        self._tx_thread: Optional[threading.Thread] = None
     
     @dbus.service.method(BLUEZ_PROFILE, in_signature='oha{sv}', out_signature='')
     def NewConnection(self, path, fd, properties):
         """Called when a new device connects"""
-        logger.info(f"New HID connection from {path}")
-        device_path = str(path)
+        # dbus.ObjectPath is a str subclass, usable as a dict key as-is
+        logger.info("New HID connection from %s", path)
         
-        # Get file descriptor
+        # Wrap the file descriptor without dup()ing it; the socket takes
+        # ownership, and family/type (L2CAP SEQPACKET) are read from the fd
         fd_obj = fd.take()
-        fd_socket = socket.fromfd(fd_obj, socket.AF_UNIX, socket.SOCK_STREAM)
+        fd_socket = socket.socket(fileno=fd_obj)
+        fd_socket.setblocking(False)
         
-        # For HID, we typically need two channels: control and interrupt
-        # This is a simplified implementation
-        self.connected_devices[device_path] = fd_socket
-        logger.info(f"Device {device_path} connected")
+        # HID uses two channels: control and interrupt. Reports go out on
+        # the interrupt channel only.
+        psm = self._channel_psm(fd_socket, properties)
+        with self._tx_lock:
+            channels = self.connected_devices.setdefault(path, {})
+            old_socket = channels.get(psm)
+            channels[psm] = fd_socket
+            if old_socket is not None:
+                self._tx_backlog.pop(old_socket, None)
+            self._refresh_sockets()
+        if old_socket is not None:
+            old_socket.close()
+        logger.info("Device %s connected (PSM 0x%02x)", path, psm)
+    
+    @staticmethod
+    def _channel_psm(fd_socket: socket.socket, properties) -> int:
+        """Work out which HID channel a connection is; unknown counts as interrupt"""
+        psm = properties.get('PSM')
+        if psm is None:
+            try:
+                # L2CAP socket names are (bdaddr, psm)
+                name = fd_socket.getsockname()
+                if isinstance(name, tuple) and len(name) == 2:
+                    psm = name[1]
+            except OSError:
+                pass
+        if psm in (HID_PSM_CONTROL, HID_PSM_INTERRUPT):
+            return int(psm)
+        return HID_PSM_INTERRUPT
     
     @dbus.service.method(BLUEZ_PROFILE, in_signature='o', out_signature='')
     def RequestDisconnection(self, path):
         """Called when device disconnects"""
-        device_path = str(path)
-        if device_path in self.connected_devices:
+        with self._tx_lock:
+            channels = self.connected_devices.pop(path, None)
+            if channels is None:
+                return
+            for fd_socket in channels.values():
+                self._tx_backlog.pop(fd_socket, None)
+            self._refresh_sockets()
+        for fd_socket in channels.values():
             try:
-                self.connected_devices[device_path].close()
+                fd_socket.close()
             except:
                 pass
-            del self.connected_devices[device_path]
-            logger.info(f"Device {device_path} disconnected")
+        logger.info("Device %s disconnected", path)
+    
+    def _refresh_sockets(self):
+        """Rebuild the interrupt socket list from connected_devices (lock held)"""
+        self._sockets = [
+            (device_path, channels[HID_PSM_INTERRUPT])
+            for device_path, channels in self.connected_devices.items()
+            if HID_PSM_INTERRUPT in channels
+        ]
     
     @dbus.service.method(BLUEZ_PROFILE, in_signature='', out_signature='')
     def Release(self):
@@ -143,13 +211,110 @@ class HIDProfile(dbus.service.Object):
         for device_path in list(self.connected_devices.keys()):
             self.RequestDisconnection(device_path)
     
-    def send_report(self, report_data: bytes):
-        """Send HID report to all connected devices"""
-        for device_path, socket_fd in self.connected_devices.items():
+    def send_report(self, report_data: ReportBuffer, droppable: bool = False):
+        """
+        Send HID report to the interrupt channel of all connected devices.
+        
+        Sockets are non-blocking, so this never waits on the Bluetooth link.
+        If a socket cannot take the whole report, the remainder is copied
+        into that socket's backlog and sent in order by the writer thread.
+        
+        Each report is one send() per interrupt socket. Batching across
+        sockets (sendmsg/io_uring style) does not apply: every socket needs
+        its own syscall, and an L2CAP SEQPACKET write is one HID report.
+        
+        Args:
+            report_data: Any bytes-like object; pooled buffers are sent
+                without copying
+            droppable: True for mouse motion reports, which may be discarded
+                if the backlog overflows; all other reports are always kept
+        """
+        with self._tx_lock:
+            # Immutable copy for backlogs, made at most once per report and
+            # shared by every socket that needs it
+            snapshot = None
+            for device_path, socket_fd in self._sockets:
+                if self._tx_backlog.get(socket_fd):
+                    # Keep ordering behind reports that are still waiting
+                    if snapshot is None:
+                        snapshot = bytes(report_data)
+                    self._queue_backlog(socket_fd, snapshot, droppable)
+                    continue
+                try:
+                    sent = socket_fd.send(report_data)
+                except BlockingIOError:
+                    sent = 0
+                except OSError as e:
+                    logger.error("Error sending report to %s: %s", device_path, e)
+                    continue
+                if sent < len(report_data):
+                    if snapshot is None:
+                        snapshot = bytes(report_data)
+                    # A partly sent report must finish, or the stream misframes
+                    self._queue_backlog(socket_fd, memoryview(snapshot)[sent:], False)
+    
+    def _queue_backlog(self, socket_fd: socket.socket, data: ReportBuffer, droppable: bool):
+        """Queue data for a congested socket and make sure the writer runs (lock held)"""
+        backlog = self._tx_backlog.get(socket_fd)
+        if backlog is None:
+            backlog = self._tx_backlog[socket_fd] = deque()
+        elif len(backlog) >= TX_BACKLOG_LEN:
+            # Drop the oldest queued motion report, superseded by later ones.
+            # The head is skipped since it may be partially sent.
+            for index, (_, old_droppable) in enumerate(backlog):
+                if index and old_droppable:
+                    del backlog[index]
+                    logger.warning("Link congested, dropped a queued mouse motion report")
+                    break
+        backlog.append((data, droppable))
+        
+        if self._tx_thread is None:
+            self._tx_thread = threading.Thread(target=self._drain_backlog, daemon=True)
+            self._tx_thread.start()
+    
+    def _drain_backlog(self):
+        """Writer thread: flush backlogs as sockets become writable, exit when empty"""
+        while True:
+            with self._tx_lock:
+                if not self._tx_backlog:
+                    self._tx_thread = None
+                    return
+                pending = list(self._tx_backlog)
+            
             try:
-                socket_fd.sendall(report_data)
-            except Exception as e:
-                logger.error(f"Error sending report to {device_path}: {e}")
+                _, writable, _ = select.select([], pending, [], TX_WAIT_TIMEOUT)
+            except (OSError, ValueError):
+                # A socket was closed while waiting; forget its backlog
+                with self._tx_lock:
+                    for socket_fd in pending:
+                        if socket_fd.fileno() < 0:
+                            self._tx_backlog.pop(socket_fd, None)
+                continue
+            
+            with self._tx_lock:
+                for socket_fd in writable:
+                    backlog = self._tx_backlog.get(socket_fd)
+                    # A stream socket may merge queued reports into one
+                    # packet; on SEQPACKET each write must stay one report
+                    more = socket.MSG_MORE if socket_fd.type == socket.SOCK_STREAM else 0
+                    while backlog:
+                        data = backlog[0][0]
+                        try:
+                            # MSG_MORE on all but the last queued report
+                            sent = socket_fd.send(data, more if len(backlog) > 1 else 0)
+                        except BlockingIOError:
+                            break
+                        except OSError as e:
+                            logger.error("Error sending queued reports: %s", e)
+                            backlog.clear()
+                            break
+                        if sent < len(data):
+                            # Partial write: keep the unsent tail without copying
+                            backlog[0] = (memoryview(data)[sent:], False)
+                            break
+                        backlog.popleft()
+                    if not backlog:
+                        self._tx_backlog.pop(socket_fd, None)
 
 
 class BluetoothHID:
@@ -166,11 +331,16 @@ class BluetoothHID:
         self.bus = None
         self.profile = None
         self.profile_manager = None
-        self.adapter = None
+        self.adapter_props = None  # org.freedesktop.DBus.Properties of the adapter
         self.adapter_path = None
         self.mainloop = None
         self.connected = False
         
+        # Mouse flush timer, armed only while there is motion to send
+        self._mouse_flush: Optional[Callable[[], bool]] = None
+        self._mouse_flush_id: Optional[int] = None
+        self._mouse_flush_lock = threading.Lock()
+        
         # Initialize D-Bus
         dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
         self.bus = dbus.SystemBus()
@@ -186,7 +356,7 @@ class BluetoothHID:
             
             # Create profile object
             profile_path = '/org/bluez/hid/profile'
-            self.profile = HIDProfile(self.bus, profile_path, self._on_report_needed)
+            self.profile = HIDProfile(self.bus, profile_path)
             
             # Register profile
             opts = {
@@ -223,68 +393,112 @@ class BluetoothHID:
                 self.profile_manager.UnregisterProfile(profile_path)
                 logger.info("HID Profile unregistered")
             except Exception as e:
-                logger.error(f"Failed to unregister profile: {e}")
+                logger.error("Failed to unregister profile: %s", e)
+    
+    def _find_adapter(self) -> bool:
+        """Look up the first Bluetooth adapter once and cache its properties interface"""
+        obj_manager = dbus.Interface(
+            self.bus.get_object(BLUEZ_SERVICE, '/'),
+            DBUS_OBJECT_MANAGER
+        )
+        
+        objects = obj_manager.GetManagedObjects()
+        for path, interfaces in objects.items():
+            if BLUEZ_ADAPTER in interfaces:
+                self.adapter_path = path
+                break
+        
+        if not self.adapter_path:
+            return False
+        
+        self.adapter_props = dbus.Interface(
+            self.bus.get_object(BLUEZ_SERVICE, self.adapter_path),
+            DBUS_PROPERTIES
+        )
+        return True
     
     def set_discoverable(self, discoverable: bool = True) -> bool:
         """Set adapter to discoverable mode"""
         try:
-            # Find adapter
-            obj_manager = dbus.Interface(
-                self.bus.get_object(BLUEZ_SERVICE, '/'),
-                'org.freedesktop.DBus.ObjectManager'
-            )
-            
-            objects = obj_manager.GetManagedObjects()
-            for path, interfaces in objects.items():
-                if BLUEZ_ADAPTER in interfaces:
-                    self.adapter_path = path
-                    break
-            
-            if not self.adapter_path:
-                logger.error("No Bluetooth adapter found")
-                return False
-            
-            # Get adapter interface
-            self.adapter = dbus.Interface(
-                self.bus.get_object(BLUEZ_SERVICE, self.adapter_path),
-                BLUEZ_ADAPTER
-            )
+            if self.adapter_props is None:
+                if not discoverable:
+                    # Never made discoverable by us, nothing to undo
+                    return True
+                if not self._find_adapter():
+                    logger.error("No Bluetooth adapter found")
+                    return False
             
             # Set discoverable
-            self.adapter.SetProperty('Discoverable', discoverable)
+            self.adapter_props.Set(BLUEZ_ADAPTER, 'Discoverable', dbus.Boolean(discoverable))
             if discoverable:
-                self.adapter.SetProperty('Pairable', True)
+                # Fire and forget; no need to wait for a second round trip
+                self.adapter_props.Set(
+                    BLUEZ_ADAPTER, 'Pairable', dbus.Boolean(True),
+                    reply_handler=lambda: None,
+                    error_handler=lambda e: logger.warning("Failed to set pairable: %s", e)
+                )
             
-            logger.info(f"Adapter discoverable: {discoverable}")
+            logger.info("Adapter discoverable: %s", discoverable)
             return True
             
         except Exception as e:
-            logger.error(f"Failed to set discoverable: {e}")
+            logger.error("Failed to set discoverable: %s", e)
             return False
     
-    def _on_report_needed(self, report_data: bytes):
-        """Callback when report needs to be sent"""
-        pass
-    
-    def send_keyboard_report(self, report: bytes):
-        """Send keyboard HID report"""
-        if self.profile:
-            self.profile.send_report(report)
-    
-    def send_mouse_report(self, report: bytes):
-        """Send mouse HID report"""
+    def send_mouse_report(self, report: ReportBuffer, motion: bool = False):
+        """
+        Send mouse HID report.
+        
+        Args:
+            report: Mouse report buffer
+            motion: True for a motion-only report, which may be dropped if the
+                link stays congested; button reports are always delivered
+        """
         if self.profile:
-            self.profile.send_report(report)
+            self.profile.send_report(report, droppable=motion)
     
-    def start_mainloop(self):
-        """Start GLib main loop for D-Bus events"""
+    def start_mainloop(self, mouse_flush: Optional[Callable[[], bool]] = None):
+        """
+        Start GLib main loop for D-Bus events.
+        
+        GLib.MainLoop runs in its own thread, which sleeps in poll() until a
+        D-Bus message or an armed timeout is due. Mouse flushes therefore fire
+        every MOUSE_FLUSH_INTERVAL_MS regardless of what the Tk thread is
+        doing, and nothing wakes up periodically while the link is idle.
+        
+        Args:
+            mouse_flush: Called every MOUSE_FLUSH_INTERVAL_MS on the main loop
+                after request_mouse_flush(); returns False once there is
+                nothing left to send, which disarms the timer
+        """
+        self._mouse_flush = mouse_flush
         self.mainloop = GLib.MainLoop()
         # Run in a separate thread
-        import threading
         thread = threading.Thread(target=self.mainloop.run, daemon=True)
         thread.start()
     
+    def request_mouse_flush(self):
+        """Arm the mouse flush timer if it is not already running"""
+        with self._mouse_flush_lock:
+            if self._mouse_flush_id is None and self._mouse_flush:
+                self._mouse_flush_id = GLib.timeout_add(
+                    MOUSE_FLUSH_INTERVAL_MS, self._on_mouse_flush_timer
+                )
+    
+    def _on_mouse_flush_timer(self) -> bool:
+        """GLib timeout: flush merged mouse motion, disarm when idle"""
+        # Held across the flush so motion queued meanwhile re-arms the timer
+        with self._mouse_flush_lock:
+            if self._mouse_flush():
+                return True
+            self._mouse_flush_id = None
+            return False
+    
     def stop_mainloop(self):
         """Stop GLib main loop"""
+        with self._mouse_flush_lock:
+            if self._mouse_flush_id is not None:
+                GLib.source_remove(self._mouse_flush_id)
+                self._mouse_flush_id = None
         if self.mainloop:
             self.mainloop.quit()
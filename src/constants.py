@@ -21,6 +21,12 @@ HID_USAGE_WHEEL = 0x38
 HID_KEYBOARD_REPORT_SIZE = 8  # 1 modifier byte + 6 key bytes + 1 reserved
 HID_MOUSE_REPORT_SIZE = 4  # 1 button byte + 1 X + 1 Y + 1 wheel
 
+# Interval (ms) at which accumulated mouse motion is flushed as one report,
+# roughly one Bluetooth connection interval. The GLib timeout fires on the
+# dedicated D-Bus main loop thread, so the first report after motion starts
+# goes out within this interval.
+MOUSE_FLUSH_INTERVAL_MS = 8
+
 # Bluetooth HID Profile UUID
 HID_SERVICE_UUID = "00001124-0000-1000-8000-00805f9b34fb"
 
@@ -116,6 +122,28 @@ EVDEV_TO_HID_KEYCODES = {
     106: 0x4F, # Right
 }
 
+# evdev modifier keys -> bit in the HID keyboard report modifier byte
+EVDEV_TO_HID_MODIFIER_BITS = {
+    29: 0x01,              # Left Control
+    KEY_LEFTSHIFT: 0x02,   # Left Shift
+    56: 0x04,              # Left Alt
+    125: 0x08,             # Left Meta/Super
+    97: 0x10,              # Right Control
+    KEY_RIGHTSHIFT: 0x20,  # Right Shift
+    100: 0x40,             # Right Alt
+    126: 0x80,             # Right Meta/Super
+}
+
+# Dense lookup tables indexed by evdev key code (0 = no mapping). Every code
+# mapped above is below EVDEV_KEY_TABLE_SIZE; larger codes are unmapped.
+EVDEV_KEY_TABLE_SIZE = 256
+EVDEV_TO_HID_TABLE = bytes(
+    EVDEV_TO_HID_KEYCODES.get(code, 0) for code in range(EVDEV_KEY_TABLE_SIZE)
+)
+EVDEV_TO_HID_MODIFIER_TABLE = bytes(
+    EVDEV_TO_HID_MODIFIER_BITS.get(code, 0) for code in range(EVDEV_KEY_TABLE_SIZE)
+)
+
 # Mouse button mappings
 MOUSE_BUTTON_LEFT = 0x01
 MOUSE_BUTTON_RIGHT = 0x02
@@ -126,3 +154,10 @@ EVDEV_TO_MOUSE_BUTTON = {
     273: MOUSE_BUTTON_RIGHT,   # BTN_RIGHT
     274: MOUSE_BUTTON_MIDDLE,  # BTN_MIDDLE
 }
+
+# Dense lookup table indexed by (evdev button code - EVDEV_BTN_MOUSE)
+EVDEV_BTN_MOUSE = 272  # BTN_LEFT, first code of the mouse button range
+EVDEV_MOUSE_TABLE_SIZE = 16
+EVDEV_TO_MOUSE_BUTTON_TABLE = bytes(
+    EVDEV_TO_MOUSE_BUTTON.get(EVDEV_BTN_MOUSE + i, 0) for i in range(EVDEV_MOUSE_TABLE_SIZE)
+)
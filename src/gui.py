@@ -4,6 +4,9 @@ import tkinter as tk
 from tkinter import ttk
 from typing import Optional, Callable
 
+# Status label updates are coalesced to the latest text at this interval (ms)
+STATUS_DEBOUNCE_MS = 50
+
 
 class SharingGUI:
     """Main GUI window for the sharing application"""
@@ -27,6 +30,12 @@ class SharingGUI:
         
         self.is_sharing = False
         
+        # Debounced status label: last text shown, text waiting to be shown,
+        # and the pending Tk after() id
+        self._status_text = "Status: Not connected"
+        self._status_pending: Optional[str] = None
+        self._status_timer = None
+        
         self._create_widgets()
     
     def _create_widgets(self):
@@ -55,7 +64,7 @@ class SharingGUI:
         # Status label
         self.status_label = ttk.Label(
             main_frame,
-            text="Status: Not connected",
+            text=self._status_text,
             font=("Arial", 10)
         )
         self.status_label.grid(row=2, column=0, columnspan=2, pady=10)
@@ -96,15 +105,15 @@ class SharingGUI:
         if sharing:
             self.action_button.config(text="Stop")
             if status_text:
-                self.status_label.config(text=f"Status: {status_text}")
+                self._set_status_text(f"Status: {status_text}")
             else:
-                self.status_label.config(text="Status: Sharing... Waiting for connection")
+                self._set_status_text("Status: Sharing... Waiting for connection")
         else:
             self.action_button.config(text="Share")
             if status_text:
-                self.status_label.config(text=f"Status: {status_text}")
+                self._set_status_text(f"Status: {status_text}")
             else:
-                self.status_label.config(text="Status: Not connected")
+                self._set_status_text("Status: Not connected")
     
     def update_status(self, text: str):
         """
@@ -113,7 +122,22 @@ class SharingGUI:
         Args:
             text: Status text to display
         """
-        self.status_label.config(text=f"Status: {text}")
+        self._set_status_text(f"Status: {text}")
+    
+    def _set_status_text(self, text: str):
+        """Queue status label text; only the latest value within STATUS_DEBOUNCE_MS is shown"""
+        self._status_pending = text
+        if self._status_timer is None:
+            self._status_timer = self.root.after(STATUS_DEBOUNCE_MS, self._flush_status)
+    
+    def _flush_status(self):
+        """Apply the pending status text, skipping it if unchanged"""
+        self._status_timer = None
+        text = self._status_pending
+        self._status_pending = None
+        if text is not None and text != self._status_text:
+            self._status_text = text
+            self.status_label.config(text=text)
     
     def run(self):
         """Start GUI main loop"""
@@ -121,5 +145,8 @@ class SharingGUI:
     
     def quit(self):
         """Quit GUI"""
+        if self._status_timer is not None:
+            self.root.after_cancel(self._status_timer)
+            self._status_timer = None
         self.root.quit()
         self.root.destroy()
@@ -1,29 +1,78 @@
 """HID report generation for keyboard and mouse events"""
 
-from typing import Optional, Dict, Set
+import struct
+import threading
+from array import array
+from typing import Optional
 from src.constants import (
-    EVDEV_TO_HID_KEYCODES,
-    EVDEV_TO_MOUSE_BUTTON,
+    EVDEV_BTN_MOUSE,
+    EVDEV_KEY_TABLE_SIZE,
+    EVDEV_MOUSE_TABLE_SIZE,
+    EVDEV_TO_HID_MODIFIER_TABLE,
+    EVDEV_TO_HID_TABLE,
+    EVDEV_TO_MOUSE_BUTTON_TABLE,
     HID_KEYBOARD_REPORT_SIZE,
     HID_MOUSE_REPORT_SIZE,
-    KEY_LEFTSHIFT,
-    KEY_RIGHTSHIFT,
-    KEY_SPACE,
 )
 
 
+# Number of simultaneous non-modifier keys in a boot keyboard report
+_KEY_SLOTS = 6
+
+# Mouse report layout: buttons, then signed X, Y and wheel deltas. Compiled
+# once so packing skips the format-string cache lookup per report.
+_MOUSE_REPORT = struct.Struct('<Bbbb')
+assert _MOUSE_REPORT.size == HID_MOUSE_REPORT_SIZE
+
+# Number of preallocated report buffers handed out round-robin (power of two)
+REPORT_POOL_SIZE = 8
+
+
 class HIDReportGenerator:
-    """Generates USB HID reports from evdev events"""
+    """
+    Generates USB HID reports from evdev events.
+    
+    Reports are returned in buffers taken round-robin from a small
+    preallocated pool, so no memory is allocated per event. A returned
+    buffer is overwritten REPORT_POOL_SIZE reports later; callers that
+    need to keep a report longer than that must copy it.
+    """
+    
+    # Fixed attribute layout: slot access is cheaper than an instance dict
+    # lookup on the per-event path
+    __slots__ = (
+        'modifier_state', '_slots', '_nslots', '_overflow',
+        'mouse_buttons', 'mouse_x', 'mouse_y', 'mouse_wheel',
+        '_mouse_dirty', '_mouse_lock',
+        '_kbd_pool', '_kbd_idx', '_mouse_pool', '_mouse_idx',
+    )
     
     def __init__(self):
-        self.active_keys: Set[int] = set()
+        # Keyboard state is edited in place on press/release instead of being
+        # rebuilt on every event. Pressed non-modifier HID keycodes occupy the
+        # first _nslots slots; the rest stay zero so the array is the report's
+        # key field as-is.
         self.modifier_state = 0
+        self._slots = array('B', bytes(_KEY_SLOTS))
+        self._nslots = 0
+        # Keys held while all slots were taken, in press order; one is moved
+        # into a slot whenever a slotted key is released
+        self._overflow = []
         self.mouse_buttons = 0
         self.mouse_x = 0
         self.mouse_y = 0
         self.mouse_wheel = 0
+        # Mouse motion is accumulated by the input thread and flushed from the
+        # D-Bus main loop, so the mouse state is shared between threads
+        self._mouse_dirty = False
+        self._mouse_lock = threading.Lock()
         
-    def process_keyboard_event(self, key_code: int, value: int) -> Optional[bytes]:
+        self._kbd_pool = [bytearray(HID_KEYBOARD_REPORT_SIZE) for _ in range(REPORT_POOL_SIZE)]
+        self._kbd_idx = 0
+        self._mouse_pool = [bytearray(HID_MOUSE_REPORT_SIZE) for _ in range(REPORT_POOL_SIZE)]
+        self._mouse_idx = 0
+        
+    def process_keyboard_event(self, key_code: int, value: int) -> bytearray:
         """
         Process a keyboard event and generate HID report if needed.
         
@@ -32,24 +81,51 @@ class HIDReportGenerator:
             value: 0 = released, 1 = pressed, 2 = held
             
         Returns:
-            HID keyboard report bytes or None if no report needed
+            Pooled HID keyboard report buffer
         """
-        if value == 0:  # Key released
-            if key_code in self.active_keys:
-                self.active_keys.remove(key_code)
-        elif value == 1:  # Key pressed
-            self.active_keys.add(key_code)
-        elif value == 2:  # Key held (repeat)
-            # Already tracked, no change needed
-            pass
+        if key_code < EVDEV_KEY_TABLE_SIZE:
+            mod_bit = EVDEV_TO_HID_MODIFIER_TABLE[key_code]
+            hid_key = EVDEV_TO_HID_TABLE[key_code]
+        else:
+            mod_bit = hid_key = 0
         
-        # Update modifier state
-        self._update_modifiers()
+        if value == 1:  # Key pressed
+            if mod_bit:
+                self.modifier_state |= mod_bit
+            else:
+                # Unused slots are 0, so scanning all six is the same as
+                # scanning the pressed ones
+                if hid_key and hid_key not in self._slots:
+                    if self._nslots < _KEY_SLOTS:
+                        self._slots[self._nslots] = hid_key
+                        self._nslots += 1
+                    elif hid_key not in self._overflow:
+                        self._overflow.append(hid_key)
+        elif value == 0:  # Key released
+            if mod_bit:
+                self.modifier_state &= ~mod_bit
+            elif hid_key:
+                self._release_slot(hid_key)
+        # value == 2 (held/repeat): already tracked, no change needed
         
-        # Generate report
         return self._generate_keyboard_report()
     
-    def process_mouse_event(self, button_code: int, value: int) -> Optional[bytes]:
+    def _release_slot(self, hid_key: int):
+        """Swap-remove a HID keycode from the pressed slots"""
+        slots = self._slots
+        if hid_key in slots:
+            if self._overflow:
+                # A slot frees up: the longest-waiting held key takes it
+                slots[slots.index(hid_key)] = self._overflow.pop(0)
+                return
+            last = self._nslots - 1
+            slots[slots.index(hid_key)] = slots[last]
+            slots[last] = 0
+            self._nslots = last
+        elif hid_key in self._overflow:
+            self._overflow.remove(hid_key)
+    
+    def process_mouse_event(self, button_code: int, value: int) -> bytearray:
         """
         Process a mouse button event.
         
@@ -58,129 +134,98 @@ class HIDReportGenerator:
             value: 0 = released, 1 = pressed
             
         Returns:
-            HID mouse report bytes or None
+            Pooled HID mouse report buffer. Button reports are never deferred;
+            they also carry any motion accumulated so far.
         """
-        if button_code in EVDEV_TO_MOUSE_BUTTON:
-            button_mask = EVDEV_TO_MOUSE_BUTTON[button_code]
-            if value == 1:  # Pressed
-                self.mouse_buttons |= button_mask
-            elif value == 0:  # Released
-                self.mouse_buttons &= ~button_mask
-        
-        return self._generate_mouse_report()
+        with self._mouse_lock:
+            index = button_code - EVDEV_BTN_MOUSE
+            if 0 <= index < EVDEV_MOUSE_TABLE_SIZE:
+                button_mask = EVDEV_TO_MOUSE_BUTTON_TABLE[index]
+            else:
+                button_mask = 0
+            
+            if button_mask:
+                if value == 1:  # Pressed
+                    self.mouse_buttons |= button_mask
+                elif value == 0:  # Released
+                    self.mouse_buttons &= ~button_mask
+            
+            return self._generate_mouse_report()
     
-    def process_mouse_movement(self, rel_x: int, rel_y: int, rel_wheel: int = 0) -> bytes:
+    def process_mouse_movement(self, rel_x: int, rel_y: int, rel_wheel: int = 0) -> None:
         """
-        Process mouse movement and generate HID report.
+        Accumulate mouse movement for the next flushed report.
+        
+        Motion arriving faster than the Bluetooth link can carry it is merged
+        into one report by flush_mouse_report instead of being sent per event.
         
         Args:
             rel_x: Relative X movement
             rel_y: Relative Y movement
             rel_wheel: Relative wheel movement
-            
-        Returns:
-            HID mouse report bytes
         """
-        self.mouse_x = rel_x
-        self.mouse_y = rel_y
-        self.mouse_wheel = rel_wheel
-        
-        return self._generate_mouse_report()
+        with self._mouse_lock:
+            self.mouse_x += rel_x
+            self.mouse_y += rel_y
+            self.mouse_wheel += rel_wheel
+            self._mouse_dirty = True
     
-    def _update_modifiers(self):
-        """Update modifier byte based on active keys"""
-        self.modifier_state = 0
-        
-        if KEY_LEFTSHIFT in self.active_keys or KEY_RIGHTSHIFT in self.active_keys:
-            # Check which shift is pressed
-            if KEY_LEFTSHIFT in self.active_keys:
-                self.modifier_state |= 0x02  # Left Shift
-            if KEY_RIGHTSHIFT in self.active_keys:
-                self.modifier_state |= 0x20  # Right Shift
+    def flush_mouse_report(self) -> Optional[bytearray]:
+        """
+        Generate a report for movement accumulated since the last report.
         
-        # Map other modifiers if needed
-        # Left Control (29), Right Control (97)
-        # Left Alt (56), Right Alt (100)
-        # Left Meta (125), Right Meta (126)
-        for key_code in self.active_keys:
-            if key_code == 29:  # Left Control
-                self.modifier_state |= 0x01
-            elif key_code == 97:  # Right Control
-                self.modifier_state |= 0x10
-            elif key_code == 56:  # Left Alt
-                self.modifier_state |= 0x04
-            elif key_code == 100:  # Right Alt
-                self.modifier_state |= 0x40
-            elif key_code == 125:  # Left Meta
-                self.modifier_state |= 0x08
-            elif key_code == 126:  # Right Meta
-                self.modifier_state |= 0x80
+        Returns:
+            Pooled HID mouse report buffer, or None if there was no movement
+        """
+        with self._mouse_lock:
+            if not self._mouse_dirty:
+                return None
+            return self._generate_mouse_report()
     
-    def _generate_keyboard_report(self) -> bytes:
+    def _generate_keyboard_report(self) -> bytearray:
         """
-        Generate HID keyboard report.
+        Copy the current keyboard state into the next pooled buffer.
         Format: [modifier, reserved, key1, key2, key3, key4, key5, key6]
         """
-        report = bytearray(HID_KEYBOARD_REPORT_SIZE)
-        report[0] = self.modifier_state & 0xFF
-        
-        # Convert active keys to HID keycodes
-        hid_keys = []
-        for evdev_code in self.active_keys:
-            # Skip modifiers (they're in modifier byte)
-            if evdev_code in (KEY_LEFTSHIFT, KEY_RIGHTSHIFT, 29, 97, 56, 100, 125, 126):
-                continue
-            
-            if evdev_code in EVDEV_TO_HID_KEYCODES:
-                hid_key = EVDEV_TO_HID_KEYCODES[evdev_code]
-                if hid_key not in hid_keys:
-                    hid_keys.append(hid_key)
-        
-        # Fill key slots (max 6 keys)
-        for i, hid_key in enumerate(hid_keys[:6]):
-            report[2 + i] = hid_key
-        
-        return bytes(report)
+        report = self._kbd_pool[self._kbd_idx]
+        self._kbd_idx = (self._kbd_idx + 1) & (REPORT_POOL_SIZE - 1)
+        report[0] = self.modifier_state
+        report[1] = 0
+        report[2:] = self._slots
+        return report
     
-    def _generate_mouse_report(self) -> bytes:
+    def _generate_mouse_report(self) -> bytearray:
         """
-        Generate HID mouse report.
+        Generate HID mouse report into the next pooled buffer (lock held).
         Format: [buttons, x, y, wheel]
         """
-        report = bytearray(HID_MOUSE_REPORT_SIZE)
-        report[0] = self.mouse_buttons & 0xFF
-        report[1] = self._clamp_mouse_delta(self.mouse_x)
-        report[2] = self._clamp_mouse_delta(self.mouse_y)
-        report[3] = self._clamp_mouse_delta(self.mouse_wheel)
+        report = self._mouse_pool[self._mouse_idx]
+        self._mouse_idx = (self._mouse_idx + 1) & (REPORT_POOL_SIZE - 1)
+        # Clamp deltas to the signed 8-bit range of the report fields
+        x = self.mouse_x
+        x = -127 if x < -127 else 127 if x > 127 else x
+        y = self.mouse_y
+        y = -127 if y < -127 else 127 if y > 127 else y
+        wheel = self.mouse_wheel
+        wheel = -127 if wheel < -127 else 127 if wheel > 127 else wheel
+        _MOUSE_REPORT.pack_into(report, 0, self.mouse_buttons & 0xFF, x, y, wheel)
         
-        # Reset deltas after generating report
-        self.mouse_x = 0
-        self.mouse_y = 0
-        self.mouse_wheel = 0
+        # Carry whatever did not fit in the int8 fields into the next report
+        self.mouse_x -= x
+        self.mouse_y -= y
+        self.mouse_wheel -= wheel
+        self._mouse_dirty = bool(self.mouse_x or self.mouse_y or self.mouse_wheel)
         
-        return bytes(report)
-    
-    @staticmethod
-    def _clamp_mouse_delta(value: int) -> int:
-        """Clamp mouse delta to signed 8-bit range"""
-        return max(-127, min(127, value))
-    
-    def check_escape_combo(self) -> bool:
-        """
-        Check if escape combination is active.
-        Returns True if Left Shift + Space + Right Shift are all held.
-        """
-        return (
-            KEY_LEFTSHIFT in self.active_keys and
-            KEY_SPACE in self.active_keys and
-            KEY_RIGHTSHIFT in self.active_keys
-        )
+        return report
     
     def reset(self):
         """Reset all state"""
-        self.active_keys.clear()
         self.modifier_state = 0
+        self._slots[:] = array('B', bytes(_KEY_SLOTS))
+        self._nslots = 0
+        self._overflow.clear()
         self.mouse_buttons = 0
         self.mouse_x = 0
         self.mouse_y = 0
         self.mouse_wheel = 0
+        self._mouse_dirty = False
@@ -1,13 +1,37 @@
 """Input device grabbing and event capture using evdev"""
 
+import errno
+import os
+import queue
+import select
+import struct
 import threading
 import logging
 from typing import Optional, Callable, List
-from evdev import InputDevice, list_devices, ecodes, categorize
+from evdev import InputDevice, list_devices, ecodes
+from evdev.ecodes import EV_KEY, EV_REL, EV_SYN, REL_X, REL_Y, REL_WHEEL, SYN_REPORT
 from src.constants import KEY_LEFTSHIFT, KEY_SPACE, KEY_RIGHTSHIFT
 
 logger = logging.getLogger(__name__)
 
+# Keys whose presence marks a device as a keyboard when probing, most common
+# first so a typical keyboard matches on the first lookup
+_KEYBOARD_PROBE_KEYS = (
+    ecodes.KEY_A, ecodes.KEY_ENTER, ecodes.KEY_1,
+    ecodes.KEY_B, ecodes.KEY_C, ecodes.KEY_2,
+)
+
+# Kernel struct input_event: struct timeval, __u16 type, __u16 code, __s32 value
+_INPUT_EVENT = struct.Struct('llHHi')
+# Events read from a device per wakeup; more stay queued for the next poll
+READ_BATCH_EVENTS = 64
+
+# Real-time priority requested for the capture thread (SCHED_FIFO, 1-99)
+CAPTURE_THREAD_PRIORITY = 20
+
+# Bits of the held-key mask that make up the escape combination
+ESCAPE_MASK = (1 << KEY_LEFTSHIFT) | (1 << KEY_SPACE) | (1 << KEY_RIGHTSHIFT)
+
 
 class InputGrabber:
     """Manages exclusive input device grabbing and event forwarding"""
@@ -30,60 +54,83 @@ class InputGrabber:
         self.mouse_move_callback = mouse_move_callback
         self.escape_callback = escape_callback
         
+        # Whether events from each device are needed at all
+        self._has_kb = bool(keyboard_callback or escape_callback)
+        self._has_mouse = bool(mouse_button_callback or mouse_move_callback)
+        
         self.keyboard_device: Optional[InputDevice] = None
         self.mouse_device: Optional[InputDevice] = None
         
         self.grabbed_devices: List[InputDevice] = []
         self.running = False
         self.thread: Optional[threading.Thread] = None
+        # eventfd that wakes the capture loop for shutdown; owned (and closed)
+        # by the capture loop, guarded so stop_capture never writes to a
+        # closed or reused fd
+        self._wake_fd: Optional[int] = None
+        self._wake_lock = threading.Lock()
+        
+        # Callbacks run on a separate dispatch thread so a slow consumer never
+        # stalls device reads; the capture thread only enqueues (callback, args)
+        self._dispatch_queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._dispatch_thread: Optional[threading.Thread] = None
         
-        self.active_keys = set()
+        # Bitmask of held keys (bit n set while key code n is down)
+        self._mod_mask = 0
+        
+        # Relative motion accumulated until the next SYN_REPORT
+        self._rx = 0
+        self._ry = 0
+        self._rw = 0
     
-    def find_devices(self) -> tuple[Optional[str], Optional[str]]:
+    def find_devices(self) -> tuple[Optional[InputDevice], Optional[InputDevice]]:
         """
         Find keyboard and mouse devices.
         
+        The selected devices are returned still open so they can be grabbed
+        without being reopened; every other probed device is closed.
+        
         Returns:
-            Tuple of (keyboard_path, mouse_path) or (None, None) if not found
+            Tuple of (keyboard_device, mouse_device), either of which is None if not found
         """
-        devices = [InputDevice(path) for path in list_devices()]
-        
-        keyboard_path = None
-        mouse_path = None
+        keyboard_device = None
+        mouse_device = None
         
-        for device in devices:
+        for path in list_devices():
+            try:
+                device = InputDevice(path)
+            except (OSError, PermissionError) as e:
+                logger.warning(f"Could not access device {path}: {e}")
+                continue
+            
             try:
-                caps = device.capabilities()
+                caps = device.capabilities(absinfo=False)
                 
                 # Check if it's a keyboard (has EV_KEY and KEY events)
                 if ecodes.EV_KEY in caps:
-                    keys = caps[ecodes.EV_KEY]
+                    keys = set(caps[ecodes.EV_KEY])
                     # Check if it has keyboard-like keys (not just mouse buttons)
-                    has_keyboard_keys = any(
-                        key in keys for key in [
-                            ecodes.KEY_A, ecodes.KEY_B, ecodes.KEY_C,
-                            ecodes.KEY_1, ecodes.KEY_2, ecodes.KEY_ENTER
-                        ]
-                    )
-                    has_mouse_buttons = any(
-                        key in keys for key in [
-                            ecodes.BTN_LEFT, ecodes.BTN_RIGHT, ecodes.BTN_MIDDLE
-                        ]
-                    )
+                    has_keyboard_keys = any(map(keys.__contains__, _KEYBOARD_PROBE_KEYS))
+                    has_mouse_buttons = ecodes.BTN_LEFT in keys
                     
                     if has_keyboard_keys and not has_mouse_buttons:
-                        if keyboard_path is None:
-                            keyboard_path = device.path
+                        if keyboard_device is None:
+                            keyboard_device = device
                             logger.info(f"Found keyboard: {device.name} at {device.path}")
                     elif has_mouse_buttons:
-                        if mouse_path is None:
-                            mouse_path = device.path
+                        if mouse_device is None:
+                            mouse_device = device
                             logger.info(f"Found mouse: {device.name} at {device.path}")
             except (OSError, PermissionError) as e:
                 logger.warning(f"Could not access device {device.path}: {e}")
-                continue
+            finally:
+                if device is not keyboard_device and device is not mouse_device:
+                    device.close()
+            
+            if keyboard_device and mouse_device:
+                break
         
-        return keyboard_path, mouse_path
+        return keyboard_device, mouse_device
     
     def grab_devices(self) -> bool:
         """
@@ -92,22 +139,30 @@ class InputGrabber:
         Returns:
             True if successful, False otherwise
         """
-        keyboard_path, mouse_path = self.find_devices()
+        keyboard_device, mouse_device = self.find_devices()
         
-        if not keyboard_path:
+        if not keyboard_device:
             logger.error("No keyboard device found")
+            if mouse_device:
+                mouse_device.close()
             return False
         
+        # The mouse stays with the local system if nothing consumes it
+        if mouse_device and not self._has_mouse:
+            logger.info(f"No mouse callbacks, leaving mouse ungrabbed: {mouse_device.name}")
+            mouse_device.close()
+            mouse_device = None
+        
         try:
             # Grab keyboard
-            self.keyboard_device = InputDevice(keyboard_path)
+            self.keyboard_device = keyboard_device
             self.keyboard_device.grab()
             self.grabbed_devices.append(self.keyboard_device)
             logger.info(f"Grabbed keyboard: {self.keyboard_device.name}")
             
             # Grab mouse if found
-            if mouse_path:
-                self.mouse_device = InputDevice(mouse_path)
+            if mouse_device:
+                self.mouse_device = mouse_device
                 self.mouse_device.grab()
                 self.grabbed_devices.append(self.mouse_device)
                 logger.info(f"Grabbed mouse: {self.mouse_device.name}")
@@ -116,17 +171,23 @@ class InputGrabber:
             
         except (OSError, PermissionError) as e:
             logger.error(f"Failed to grab devices: {e}")
+            # Close whichever device the failed grab left behind
+            for device in (keyboard_device, mouse_device):
+                if device and device not in self.grabbed_devices:
+                    device.close()
             self.release_devices()
             return False
     
     def release_devices(self):
-        """Release all grabbed devices"""
+        """Release and close all grabbed devices"""
         for device in self.grabbed_devices:
             try:
                 device.ungrab()
                 logger.info(f"Released device: {device.name}")
             except Exception as e:
                 logger.warning(f"Error releasing device {device.path}: {e}")
+            finally:
+                device.close()
         
         self.grabbed_devices.clear()
         self.keyboard_device = None
@@ -142,6 +203,12 @@ class InputGrabber:
             return
         
         self.running = True
+        self._wake_fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        self._dispatch_queue = queue.SimpleQueue()
+        self._dispatch_thread = threading.Thread(
+            target=self._dispatch_loop, args=(self._dispatch_queue,), daemon=True
+        )
+        self._dispatch_thread.start()
         self.thread = threading.Thread(target=self._capture_loop, daemon=True)
         self.thread.start()
         logger.info("Started input capture")
@@ -149,59 +216,128 @@ class InputGrabber:
     def stop_capture(self):
         """Stop capturing input events"""
         self.running = False
-        if self.thread:
+        with self._wake_lock:
+            if self._wake_fd is not None:
+                os.eventfd_write(self._wake_fd, 1)
+        current = threading.current_thread()
+        if self.thread and self.thread is not current:
             self.thread.join(timeout=2.0)
+        # Wake the dispatch thread so it exits; callbacks still queued are
+        # dropped. It may be the caller itself (escape callback), so never
+        # join it then.
+        if self._dispatch_thread:
+            self._dispatch_queue.put(None)
+            if self._dispatch_thread is not current:
+                self._dispatch_thread.join(timeout=2.0)
+            self._dispatch_thread = None
         logger.info("Stopped input capture")
     
+    def _dispatch_loop(self, dispatch_queue: queue.SimpleQueue):
+        """Run callbacks queued by the capture thread until capture stops"""
+        get = dispatch_queue.get
+        while True:
+            item = get()
+            if item is None or not self.running:
+                return
+            callback, args = item
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Error in input callback: {e}")
+    
+    def _tune_capture_thread(self):
+        """
+        Pin the calling thread to one CPU and try to make it SCHED_FIFO.
+        
+        Both are best effort: the real-time policy needs CAP_SYS_NICE or an
+        RLIMIT_RTPRIO of at least CAPTURE_THREAD_PRIORITY, and capture works
+        the same (with more scheduling jitter) without either.
+        """
+        try:
+            # Lowest core we are allowed on; pid 0 means the calling thread
+            cpu = min(os.sched_getaffinity(0))
+            os.sched_setaffinity(0, {cpu})
+        except OSError as e:
+            logger.debug(f"Could not pin capture thread: {e}")
+        
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(CAPTURE_THREAD_PRIORITY))
+            logger.info(f"Capture thread running SCHED_FIFO at priority {CAPTURE_THREAD_PRIORITY}")
+        except PermissionError:
+            logger.debug("No permission for real-time scheduling, using default policy")
+        except OSError as e:
+            logger.debug(f"Could not set real-time scheduling: {e}")
+    
     def _capture_loop(self):
         """Main event capture loop"""
-        
+        ep = None
         try:
-            # Process events from both keyboard and mouse devices
+            self._tune_capture_thread()
+            
+            # Process events from both keyboard and mouse devices, each with
+            # the handler bound for its kind. A grabbed keyboard is always
+            # read, but its events are discarded if nothing consumes them.
             devices = []
             if self.keyboard_device:
-                devices.append(('keyboard', self.keyboard_device))
+                kb_handler = self._process_keyboard_event if self._has_kb else None
+                devices.append((self.keyboard_device, kb_handler))
             if self.mouse_device:
-                devices.append(('mouse', self.mouse_device))
+                devices.append((self.mouse_device, self._process_mouse_event))
             
             if not devices:
                 logger.error("No devices available for capture")
                 return
             
-            # Use select to monitor multiple devices
-            while self.running:
+            # Register the device fds with epoll once; each wakeup then only
+            # reports the fds that are actually ready. The wake eventfd lets
+            # stop_capture interrupt the wait, so no timeout is needed.
+            ep = select.epoll()
+            wake_fd = self._wake_fd
+            ep.register(wake_fd, select.EPOLLIN)
+            fd_to_device = {}
+            for device, handler in devices:
+                ep.register(device.fd, select.EPOLLIN)
+                fd_to_device[device.fd] = (device, handler)
+            
+            # Raw input_event records are read into one reused buffer and
+            # unpacked straight to ints, skipping evdev's InputEvent objects
+            buf = bytearray(_INPUT_EVENT.size * READ_BATCH_EVENTS)
+            bufs = [buf]
+            view = memoryview(buf)
+            iter_unpack = _INPUT_EVENT.iter_unpack
+            readv = os.readv
+            
+            while self.running and fd_to_device:
                 try:
-                    # Get file descriptors for select
-                    fds = [device.fd for _, device in devices]
-                    
-                    # Wait for events (with timeout to allow checking self.running)
-                    ready, _, _ = select.select(fds, [], [], 0.1)
-                    
-                    if not ready:
-                        continue
+                    # Block until input arrives or stop_capture wakes us
+                    ready = ep.poll()
                     
                     # Process events from ready devices
-                    for device_type, device in devices:
-                        if device.fd not in ready:
-                            continue
+                    for fd, _ in ready:
+                        if fd == wake_fd:
+                            continue  # self.running is re-checked by the loop
+                        device, handler = fd_to_device[fd]
                         
                         try:
-                            # Read available events
-                            for event in device.read():
-                                if not self.running:
-                                    break
-                                
-                                if device_type == 'keyboard':
-                                    self._process_keyboard_event(event)
-                                elif device_type == 'mouse':
-                                    self._process_mouse_event(event)
+                            # Read up to one batch; shutdown is noticed by
+                            # the outer loop via the wake eventfd
+                            n = readv(fd, bufs)
+                            if not n:
+                                raise OSError(errno.ENODEV, "end of file")
                         except BlockingIOError:
-                            # No more events available
+                            # Spurious wakeup; epoll is level-triggered, so
+                            # nothing is lost by waiting for the next one
                             continue
                         except OSError as e:
                             # Device disconnected
                             logger.warning(f"Device {device.path} disconnected: {e}")
-                            break
+                            ep.unregister(fd)
+                            del fd_to_device[fd]
+                            continue
+                        
+                        if handler is not None:
+                            for _, _, etype, code, value in iter_unpack(view[:n]):
+                                handler(etype, code, value)
                     
                 except Exception as e:
                     if self.running:  # Only log if we're still supposed to be running
@@ -210,65 +346,74 @@ class InputGrabber:
         except Exception as e:
             logger.error(f"Error in capture loop: {e}")
         finally:
+            if ep is not None:
+                ep.close()
+            with self._wake_lock:
+                os.close(self._wake_fd)
+                self._wake_fd = None
+            # Let the dispatch thread exit even if capture ended on its own
+            self._dispatch_queue.put(None)
             self.running = False
     
-    def _process_keyboard_event(self, event):
+    def _process_keyboard_event(self, etype: int, key_code: int, value: int):
         """Process a keyboard event"""
-        if event.type == ecodes.EV_KEY:
-            key_code = event.code
-            value = event.value
-            
-            # Update active keys for escape detection
+        if etype == EV_KEY:
+            # Update held-key mask for escape detection
             if value == 0:  # Released
-                self.active_keys.discard(key_code)
+                self._mod_mask &= ~(1 << key_code)
             elif value == 1:  # Pressed
-                self.active_keys.add(key_code)
-            
-            # Check for escape combination
-            if self._check_escape_combo():
-                if self.escape_callback:
-                    self.escape_callback()
-                return
+                mask = self._mod_mask | (1 << key_code)
+                self._mod_mask = mask
+                
+                # The combination can only complete on a key-down edge
+                if (mask & ESCAPE_MASK) == ESCAPE_MASK:
+                    # Fire once per combination, even if more presses are
+                    # read before the queued callback stops the capture
+                    self._mod_mask = 0
+                    escape_callback = self.escape_callback
+                    if escape_callback:
+                        self._dispatch_queue.put((escape_callback, ()))
+                    return
             
             # Forward to callback
-            if self.keyboard_callback:
-                self.keyboard_callback(key_code, value)
+            keyboard_callback = self.keyboard_callback
+            if keyboard_callback:
+                self._dispatch_queue.put((keyboard_callback, (key_code, value)))
         
-        elif event.type == ecodes.EV_REL and self.mouse_device is None:
+        elif etype == EV_REL and self.mouse_device is None:
             # Handle mouse movement on keyboard device (for trackpads)
-            self._accumulate_mouse_movement(event)
+            self._accumulate_mouse_movement(key_code, value)
+        
+        elif etype == EV_SYN and key_code == SYN_REPORT:
+            self._flush_mouse_movement()
     
-    def _process_mouse_event(self, event):
+    def _process_mouse_event(self, etype: int, code: int, value: int):
         """Process a mouse event"""
-        if event.type == ecodes.EV_KEY:
+        if etype == EV_KEY:
             # Mouse button event
-            button_code = event.code
-            value = event.value
-            if self.mouse_button_callback:
-                self.mouse_button_callback(button_code, value)
+            mouse_button_callback = self.mouse_button_callback
+            if mouse_button_callback:
+                self._dispatch_queue.put((mouse_button_callback, (code, value)))
         
-        elif event.type == ecodes.EV_REL:
+        elif etype == EV_REL:
             # Mouse movement event
-            self._accumulate_mouse_movement(event)
+            self._accumulate_mouse_movement(code, value)
+        
+        elif etype == EV_SYN and code == SYN_REPORT:
+            self._flush_mouse_movement()
     
-    def _accumulate_mouse_movement(self, event):
-        """Accumulate mouse movement and send when complete"""
-        # For simplicity, send each movement event immediately
-        # A more sophisticated implementation could accumulate deltas
-        if event.code == ecodes.REL_X:
-            if self.mouse_move_callback:
-                self.mouse_move_callback(event.value, 0, 0)
-        elif event.code == ecodes.REL_Y:
-            if self.mouse_move_callback:
-                self.mouse_move_callback(0, event.value, 0)
-        elif event.code == ecodes.REL_WHEEL:
-            if self.mouse_move_callback:
-                self.mouse_move_callback(0, 0, event.value)
+    def _accumulate_mouse_movement(self, code: int, value: int):
+        """Accumulate mouse movement until the packet's SYN_REPORT"""
+        if code == REL_X:
+            self._rx += value
+        elif code == REL_Y:
+            self._ry += value
+        elif code == REL_WHEEL:
+            self._rw += value
     
-    def _check_escape_combo(self) -> bool:
-        """Check if escape combination is active"""
-        return (
-            KEY_LEFTSHIFT in self.active_keys and
-            KEY_SPACE in self.active_keys and
-            KEY_RIGHTSHIFT in self.active_keys
-        )
+    def _flush_mouse_movement(self):
+        """Forward the movement of one evdev packet as a single callback"""
+        if self._rx or self._ry or self._rw:
+            if self.mouse_move_callback:
+                self._dispatch_queue.put((self.mouse_move_callback, (self._rx, self._ry, self._rw)))
+            self._rx = self._ry = self._rw = 0